@@ -1,39 +1,68 @@
 const TelegramBot = require('node-telegram-bot-api');
 const axios = require('axios');
+const https = require('https');
+const crypto = require('crypto');
 const schedule = require('node-schedule');
 const { Pool } = require('pg');
 require('dotenv').config();
 
 // --- Configuración de Variables de Entorno ---
-const TELEGRAM_TOKEN = process.env.TELEGRAM_TOKEN;
-const TELEGRAM_CHANNEL_ID = process.env.TELEGRAM_CHANNEL_ID;
-const DATABASE_URL = process.env.DATABASE_URL;
-const API_URL = process.env.API_URL || 'https://backend-vuelta-rapida-production.up.railway.app/api/races';
-const API_DAYS_AHEAD = parseInt(process.env.API_DAYS_AHEAD, 10) || 90;
-const NOTIFICATION_LEAD_HOURS = parseInt(process.env.NOTIFICATION_LEAD_HOURS, 10) || 8;
-const CHECK_INTERVAL_HOURS = parseInt(process.env.CHECK_INTERVAL_HOURS, 10) || 4;
-const F1_CATEGORY_ID = process.env.F1_CATEGORY_ID || 'f1';
+// Se lee una sola vez al arrancar y se congela para que nada la modifique en tiempo de ejecución.
+const CONFIG = Object.freeze({
+    telegramToken: process.env.TELEGRAM_TOKEN,
+    telegramChannelId: process.env.TELEGRAM_CHANNEL_ID,
+    databaseUrl: process.env.DATABASE_URL,
+    apiUrl: process.env.API_URL || 'https://backend-vuelta-rapida-production.up.railway.app/api/races',
+    apiDaysAhead: parseInt(process.env.API_DAYS_AHEAD, 10) || 90,
+    // La ventana de fechas que se pide a la API cambia una vez por día, así que la caché no puede durar más
+    apiCacheTtlMinutes: Math.min(parseInt(process.env.API_CACHE_TTL_MINUTES, 10) || 60, 24 * 60),
+    notificationLeadHours: parseInt(process.env.NOTIFICATION_LEAD_HOURS, 10) || 8,
+    checkIntervalHours: parseInt(process.env.CHECK_INTERVAL_HOURS, 10) || 4,
+    f1CategoryId: process.env.F1_CATEGORY_ID || 'f1',
+});
+
+const MS_POR_HORA = 60 * 60 * 1000;
+const MS_POR_DIA = 24 * MS_POR_HORA;
 
 // --- Validación de Variables Críticas ---
-if (!TELEGRAM_TOKEN || !TELEGRAM_CHANNEL_ID || !DATABASE_URL) {
+if (!CONFIG.telegramToken || !CONFIG.telegramChannelId || !CONFIG.databaseUrl) {
     console.error('Error: Faltan variables de entorno críticas (TELEGRAM_TOKEN, TELEGRAM_CHANNEL_ID, o DATABASE_URL).');
     process.exit(1);
 }
 
 // --- Configuración de la Base de Datos (PostgreSQL) ---
 const pool = new Pool({
-    connectionString: DATABASE_URL,
+    connectionString: CONFIG.databaseUrl,
     ssl: {
         rejectUnauthorized: false // Necesario para conexiones a Railway
-    }
+    },
+    // El bot hace pocas consultas y nunca más de dos a la vez: un pool chico alcanza.
+    // Las conexiones ociosas se cierran a los 10s (valor por defecto de pg), mucho antes de que Railway las corte.
+    max: 3,
+    connectionTimeoutMillis: 10000,
+    keepAlive: true,
+});
+
+// Si el servidor corta una conexión ociosa, pg emite 'error' en el pool; sin este handler el proceso se cae
+pool.on('error', (err) => {
+    console.error('Error en una conexión inactiva de la base de datos:', err.message);
 });
 
 // --- Configuración del Bot de Telegram ---
 // Usamos 'polling' para desarrollo y pruebas. Railway usará el Procfile para ejecutarlo como un 'worker'.
-const bot = new TelegramBot(TELEGRAM_TOKEN, { polling: true });
+const bot = new TelegramBot(CONFIG.telegramToken, { polling: true });
 
 console.log('Bot iniciado. Conectando a la base de datos...');
 
+/**
+ * Devuelve una promesa que se resuelve después de `ms` milisegundos.
+ * @param {number} ms Los milisegundos a esperar.
+ * @returns {Promise<void>}
+ */
+function esperar(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
 // --- Lógica de la Base de Datos ---
 
 /**
@@ -58,128 +87,415 @@ async function setupDatabase() {
 }
 
 /**
- * Verifica si un ID de sesión ya ha sido programado.
- * @param {string} sessionId El ID de la sesión.
- * @returns {Promise<boolean>} True si ya está programado, false en caso contrario.
+ * Indica si un error de pg se debe a una conexión caída (y no a la consulta en sí).
+ * @param {Error} err El error recibido.
+ * @returns {boolean}
  */
-async function isSessionScheduled(sessionId) {
-    const client = await pool.connect();
-    try {
-        const res = await client.query('SELECT 1 FROM scheduled_sessions WHERE session_id = $1', [sessionId]);
-        return res.rowCount > 0;
-    } finally {
-        client.release();
+function esErrorDeConexion(err) {
+    return ['ECONNRESET', 'EPIPE', 'ETIMEDOUT', 'ECONNREFUSED'].includes(err.code)
+        || /^(08|57P0)/.test(err.code || '') // connection_exception, admin_shutdown y similares
+        || /Connection terminated/i.test(err.message);
+}
+
+/**
+ * Ejecuta una consulta y, si falla por una conexión caída, la reintenta una vez con otra conexión.
+ * pg no verifica las conexiones antes de entregarlas, así que la primera consulta después de un
+ * período inactivo puede recibir una conexión que el servidor ya cerró.
+ * Sólo debe usarse con consultas idempotentes.
+ * @param {string} texto La consulta SQL.
+ * @param {Array} [valores] Los parámetros de la consulta.
+ * @returns {Promise<object>} El resultado de pg.
+ */
+async function consultarConReintento(texto, valores) {
+    for (let intento = 0; ; intento++) {
+        let client;
+        try {
+            client = await pool.connect();
+            const res = await client.query(texto, valores);
+            client.release();
+            return res;
+        } catch (err) {
+            const errorDeConexion = esErrorDeConexion(err);
+            if (client) {
+                client.release(errorDeConexion ? err : undefined); // Descartamos la conexión rota
+            }
+            if (!errorDeConexion || intento > 0) {
+                throw err;
+            }
+            console.log('Conexión a la base de datos caída, reintentando la consulta:', err.message);
+        }
     }
 }
 
 /**
- * Guarda un ID de sesión en la base de datos para marcarlo como programado.
- * @param {string} sessionId El ID de la sesión.
+ * Obtiene todos los IDs de sesión ya programados con una sola consulta.
+ * @returns {Promise<Set<string>>} El conjunto de IDs programados.
  */
-async function markSessionAsScheduled(sessionId) {
-    const client = await pool.connect();
-    try {
-        await client.query('INSERT INTO scheduled_sessions (session_id) VALUES ($1) ON CONFLICT (session_id) DO NOTHING', [sessionId]);
-    } finally {
-        client.release();
+async function obtenerSesionesProgramadas() {
+    const res = await consultarConReintento('SELECT session_id FROM scheduled_sessions');
+    return new Set(res.rows.map(row => row.session_id));
+}
+
+/**
+ * Guarda varios IDs de sesión en la base de datos, en una sola consulta, para marcarlos como programados.
+ * @param {string[]} sessionIds Los IDs de las sesiones.
+ */
+async function markSessionsAsScheduled(sessionIds) {
+    if (!sessionIds.length) {
+        return;
     }
+    await consultarConReintento(
+        'INSERT INTO scheduled_sessions (session_id) SELECT unnest($1::varchar[]) ON CONFLICT (session_id) DO NOTHING',
+        [sessionIds]
+    );
 }
 
 // --- Lógica de la API de F1 ---
 
+// Cliente HTTP reutilizable: mantiene las conexiones abiertas (keep-alive) para no repetir
+// el handshake TCP+TLS en cada revisión.
+const httpsAgent = new https.Agent({ keepAlive: true, maxSockets: 4 });
+const apiClient = axios.create({
+    timeout: 15000,
+    httpsAgent,
+    headers: { 'Accept-Encoding': 'gzip' },
+});
+
+const API_MAX_REINTENTOS = 3;
+const API_ESTADOS_REINTENTABLES = [502, 503, 504];
+
+/**
+ * Hace un GET a la API reintentando ante errores de red o respuestas 502/503/504.
+ * Espera 0.3s, 0.6s, 1.2s... entre intentos.
+ * @param {string} url La URL a consultar.
+ * @param {object} config Configuración adicional para axios.
+ * @returns {Promise<object>} La respuesta de axios.
+ */
+async function getConReintentos(url, config) {
+    for (let intento = 0; ; intento++) {
+        try {
+            return await apiClient.get(url, config);
+        } catch (error) {
+            const status = error.response?.status;
+            const reintentable = !error.response || API_ESTADOS_REINTENTABLES.includes(status);
+            if (!reintentable || intento >= API_MAX_REINTENTOS) {
+                throw error;
+            }
+            await esperar(300 * 2 ** intento);
+        }
+    }
+}
+
+// Caché de la última respuesta de la API. El calendario cambia muy pocas veces por temporada,
+// así que no tiene sentido pedirlo de nuevo en cada revisión o en cada /start.
+const cacheCarreras = {
+    clave: null,       // Ventana de fechas (redondeada a la hora) de la respuesta guardada
+    expiraEn: 0,       // Timestamp (ms) a partir del cual la respuesta se considera vencida
+    carreras: null,    // Última lista de carreras obtenida con éxito
+    etag: null,        // Cabecera ETag de esa respuesta, para pedidos condicionales
+    lastModified: null, // Cabecera Last-Modified de esa respuesta
+};
+
 /**
  * Obtiene las carreras de F1 desde la API.
+ * Las respuestas se guardan en caché durante API_CACHE_TTL_MINUTES. Si la API falla,
+ * se devuelve la última respuesta válida para que las revisiones sigan funcionando.
  * @returns {Promise<Array>} Una lista de carreras.
  */
 async function obtenerCarrerasF1() {
-    const fechaInicio = new Date();
-    const fechaFin = new Date();
-    fechaFin.setDate(fechaFin.getDate() + API_DAYS_AHEAD);
+    // Redondeamos el inicio al día (UTC) para que la clave de caché sea estable entre llamadas y no
+    // recorte el TTL. Las sesiones de hoy que ya empezaron se descartan al programar los avisos.
+    const minDate = Math.floor(Date.now() / MS_POR_DIA) * MS_POR_DIA;
 
     const params = {
-        minDate: fechaInicio.getTime(),
-        maxDate: fechaFin.getTime(),
+        minDate,
+        maxDate: minDate + CONFIG.apiDaysAhead * MS_POR_DIA,
+        categoryId: CONFIG.f1CategoryId, // Filtro del lado del servidor; igual filtramos abajo por si la API lo ignora
     };
 
+    const clave = `${params.minDate}-${params.maxDate}`;
+    if (cacheCarreras.clave === clave && Date.now() < cacheCarreras.expiraEn) {
+        return cacheCarreras.carreras;
+    }
+
+    // Si ya tenemos una respuesta para esta misma ventana (mismo día), pedimos sólo los cambios: un 304
+    // nos ahorra descargar y parsear el JSON. Los validadores sólo valen para la URL que los emitió, así
+    // que al cambiar de día (minDate/maxDate distintos) pedimos la respuesta completa.
+    const headers = {};
+    if (cacheCarreras.carreras && cacheCarreras.clave === clave) {
+        if (cacheCarreras.etag) headers['If-None-Match'] = cacheCarreras.etag;
+        if (cacheCarreras.lastModified) headers['If-Modified-Since'] = cacheCarreras.lastModified;
+    }
+
     try {
-        const response = await axios.get(API_URL, { params, timeout: 15000 });
+        const response = await getConReintentos(CONFIG.apiUrl, {
+            params,
+            headers,
+            validateStatus: status => (status >= 200 && status < 300) || status === 304,
+        });
+        if (response.status === 304) {
+            cacheCarreras.expiraEn = Date.now() + CONFIG.apiCacheTtlMinutes * 60 * 1000;
+            return cacheCarreras.carreras;
+        }
+
         const carreras = response.data?.races || [];
-        return carreras.filter(c => c.categoryId === F1_CATEGORY_ID);
+        // Nos quedamos sólo con los campos que usamos, para no retener el payload completo en la caché
+        const carrerasF1 = [];
+        for (const c of carreras) {
+            if (c.categoryId !== CONFIG.f1CategoryId) {
+                continue;
+            }
+            carrerasF1.push({
+                completeName: c.completeName,
+                schedules: (c.schedules || []).map(({ id, name, startAt }) => ({ id, name, startAt })),
+            });
+        }
+        cacheCarreras.clave = clave;
+        cacheCarreras.expiraEn = Date.now() + CONFIG.apiCacheTtlMinutes * 60 * 1000;
+        cacheCarreras.carreras = carrerasF1;
+        cacheCarreras.etag = response.headers.etag || null;
+        cacheCarreras.lastModified = response.headers['last-modified'] || null;
+        return carrerasF1;
     } catch (error) {
         console.error('Error al contactar la API de F1:', error.message);
+        if (cacheCarreras.carreras) {
+            console.log('Usando la última respuesta válida de la API guardada en caché.');
+            return cacheCarreras.carreras;
+        }
         return [];
     }
 }
 
 // --- Lógica de Programación de Notificaciones ---
 
+// Telegram limita los mensajes por chat (aprox. uno por segundo). Los avisos que coinciden
+// en el tiempo se encolan y se envían de a uno, con esta separación mínima entre ellos.
+const INTERVALO_MINIMO_ENVIO_MS = 1000;
+let colaEnvios = Promise.resolve();
+
+/**
+ * Envía un mensaje al canal. Si Telegram responde 429, espera lo que indica `retry_after` y reintenta una vez.
+ * @param {string} mensaje El mensaje a enviar.
+ */
+async function enviarAlCanal(mensaje) {
+    for (let intento = 0; ; intento++) {
+        try {
+            await bot.sendMessage(CONFIG.telegramChannelId, mensaje, { parse_mode: 'Markdown' });
+            console.log('Notificación enviada con éxito.');
+            return;
+        } catch (err) {
+            const retryAfter = err.response?.body?.parameters?.retry_after;
+            if (!retryAfter || intento > 0) {
+                console.error('Error al enviar notificación:', err.message);
+                return;
+            }
+            console.log(`Telegram pidió esperar ${retryAfter}s antes de reenviar la notificación.`);
+            await esperar(retryAfter * 1000);
+        }
+    }
+}
+
 /**
- * Envía una notificación al canal de Telegram.
+ * Envía una notificación al canal de Telegram, respetando el orden y el ritmo de la cola de envíos.
  * @param {string} mensaje El mensaje a enviar.
+ * @returns {Promise<void>} Se resuelve cuando el mensaje se envió (o falló).
  */
 function enviarNotificacion(mensaje) {
-    bot.sendMessage(TELEGRAM_CHANNEL_ID, mensaje, { parse_mode: 'Markdown' })
-        .then(() => console.log('Notificación enviada con éxito.'))
-        .catch(err => console.error('Error al enviar notificación:', err.message));
+    const envio = colaEnvios.then(() => enviarAlCanal(mensaje));
+    colaEnvios = envio.then(() => esperar(INTERVALO_MINIMO_ENVIO_MS));
+    return envio;
+}
+
+// Tipos de aviso que se pueden programar para una sesión
+const AVISO_PREVIO = 0;
+const AVISO_INICIO = 1;
+
+/**
+ * Arma el texto de un aviso. Se llama recién cuando el trabajo se ejecuta,
+ * así los trabajos programados sólo guardan los datos mínimos de la sesión.
+ * @param {number} tipo AVISO_PREVIO o AVISO_INICIO.
+ * @param {string} nombreEvento El nombre del evento de F1.
+ * @param {string} nombreSesion El nombre de la sesión.
+ * @param {number} inicio Timestamp (ms) de inicio de la sesión.
+ * @returns {string} El mensaje en formato Markdown.
+ */
+function construirMensaje(tipo, nombreEvento, nombreSesion, inicio) {
+    if (tipo === AVISO_INICIO) {
+        return `🟢 *¡Arrancó!* La sesión **${nombreSesion}** de **${nombreEvento}** ha comenzado.`;
+    }
+    const fechaHoraInicio = new Date(inicio);
+    return `🏎️ *¡Atención!* La sesión **${nombreSesion}** de **${nombreEvento}** comienza en ${CONFIG.notificationLeadHours} horas (a las ${fechaHoraInicio.toLocaleTimeString('es-AR', { hour: '2-digit', minute: '2-digit', timeZone: 'America/Argentina/Buenos_Aires' })} hs del ${fechaHoraInicio.toLocaleDateString('es-AR', { timeZone: 'America/Argentina/Buenos_Aires' })}).`;
+}
+
+// Avisos armados en este proceso, por ID de sesión: la clave con la que se programaron y sus trabajos.
+// node-schedule guarda los trabajos en memoria, así que tras un reinicio este mapa arranca vacío
+// aunque la tabla scheduled_sessions ya tenga las sesiones registradas.
+const trabajosPorSesion = new Map();
+
+/**
+ * Genera la clave con la que se registra una sesión programada.
+ * Incluye un hash corto del horario y el nombre, así una sesión que se mueve
+ * genera una clave nueva y se reprograma, mientras que una sin cambios se omite.
+ * @param {object} sesion El objeto de la sesión.
+ * @returns {string} La clave de la sesión.
+ */
+function claveSesion(sesion) {
+    const firma = crypto.createHash('blake2s256')
+        .update(`${sesion.startAt}|${sesion.name}`)
+        .digest('hex')
+        .slice(0, 12);
+    return `${sesion.id}_${firma}`;
 }
 
 /**
  * Programa los avisos para una sesión específica.
  * @param {object} sesion El objeto de la sesión.
  * @param {string} nombreEvento El nombre del evento de F1.
+ * @param {number} ahora Timestamp (ms) de referencia, compartido por toda la revisión.
+ * @param {string} clave La clave de la sesión (ver claveSesion).
  */
-function programarAvisosParaSesion(sesion, nombreEvento) {
+function programarAvisosParaSesion(sesion, nombreEvento, ahora, clave) {
     const { id: sesionId, name: nombreSesion, startAt } = sesion;
     const fechaHoraInicio = new Date(startAt);
+    const inicio = fechaHoraInicio.getTime();
+    if (!(inicio > ahora)) {
+        return; // Sesión ya empezada (o sin fecha válida): no hay ningún aviso que programar
+    }
+
+    // Si la sesión ya tenía avisos programados (p. ej. cambió de horario), los cancelamos
+    for (const trabajo of trabajosPorSesion.get(sesionId)?.trabajos || []) {
+        trabajo.cancel();
+    }
+    const trabajos = [];
 
     // 1. Programar aviso de X horas antes
-    const fechaAvisoPrevio = new Date(fechaHoraInicio.getTime() - NOTIFICATION_LEAD_HOURS * 60 * 60 * 1000);
-    if (fechaAvisoPrevio > new Date()) {
-        const mensajePrevio = `🏎️ *¡Atención!* La sesión **${nombreSesion}** de **${nombreEvento}** comienza en ${NOTIFICATION_LEAD_HOURS} horas (a las ${fechaHoraInicio.toLocaleTimeString('es-AR', { hour: '2-digit', minute: '2-digit', timeZone: 'America/Argentina/Buenos_Aires' })} hs del ${fechaHoraInicio.toLocaleDateString('es-AR')}).`;
-        schedule.scheduleJob(fechaAvisoPrevio, () => enviarNotificacion(mensajePrevio));
-        console.log(`Aviso de ${NOTIFICATION_LEAD_HOURS}h programado para '${nombreSesion}' el ${fechaAvisoPrevio.toLocaleString()}`);
+    const fechaAvisoPrevio = new Date(inicio - CONFIG.notificationLeadHours * MS_POR_HORA);
+    if (fechaAvisoPrevio.getTime() > ahora) {
+        trabajos.push(schedule.scheduleJob(fechaAvisoPrevio, () => enviarNotificacion(construirMensaje(AVISO_PREVIO, nombreEvento, nombreSesion, inicio))));
+        console.log(`Aviso de ${CONFIG.notificationLeadHours}h programado para '${nombreSesion}' el ${fechaAvisoPrevio.toLocaleString()}`);
     }
 
-    // 2. Programar aviso de inicio
-    if (fechaHoraInicio > new Date()) {
-        const mensajeInicio = `🟢 *¡Arrancó!* La sesión **${nombreSesion}** de **${nombreEvento}** ha comenzado.`;
-        schedule.scheduleJob(fechaHoraInicio, () => enviarNotificacion(mensajeInicio));
-        console.log(`Aviso de inicio programado para '${nombreSesion}' el ${fechaHoraInicio.toLocaleString()}`);
+    // 2. Programar aviso de inicio. Es el último aviso de la sesión: al dispararse la sacamos del mapa,
+    // salvo que mientras tanto se haya reprogramado con otra clave.
+    const trabajoInicio = schedule.scheduleJob(fechaHoraInicio, () => {
+        if (trabajosPorSesion.get(sesionId)?.clave === clave) {
+            trabajosPorSesion.delete(sesionId);
+        }
+        enviarNotificacion(construirMensaje(AVISO_INICIO, nombreEvento, nombreSesion));
+    });
+    if (!trabajoInicio) {
+        // scheduleJob devuelve null si la fecha ya pasó entre la revisión y este punto
+        trabajosPorSesion.delete(sesionId);
+        return;
     }
+    trabajos.push(trabajoInicio);
+    console.log(`Aviso de inicio programado para '${nombreSesion}' el ${fechaHoraInicio.toLocaleString()}`);
+
+    trabajosPorSesion.set(sesionId, { clave, trabajos: trabajos.filter(Boolean) });
 }
 
 /**
  * Revisa si hay nuevas carreras y programa los avisos.
+ * @returns {Promise<number|null>} Timestamp (ms) de la próxima sesión conocida, o null si no hay ninguna.
  */
-async function checkAndScheduleRaces() {
+async function revisarYProgramarCarreras() {
     console.log('Revisando si hay nuevas carreras para programar...');
-    const carrerasF1 = await obtenerCarrerasF1();
+    // La consulta a la API y la lectura de la base de datos son independientes: las hacemos en paralelo
+    const [carrerasF1, sesionesProgramadas] = await Promise.all([
+        obtenerCarrerasF1(),
+        obtenerSesionesProgramadas(),
+    ]);
     if (!carrerasF1.length) {
         console.log('No se encontraron carreras en la API en esta revisión.');
-        return;
+        return null;
     }
 
-    let nuevasSesionesProgramadas = 0;
+    const ahora = Date.now();
+    const nuevasClaves = [];
+    let sesionesRearmadas = 0;
+    let proximaSesion = null;
     for (const carrera of carrerasF1) {
         const nombreEvento = carrera.completeName || 'Evento F1';
         for (const sesion of carrera.schedules) {
-            if (sesion.id && new Date(sesion.startAt) > new Date()) {
-                const yaProgramada = await isSessionScheduled(sesion.id);
-                if (!yaProgramada) {
+            const inicio = new Date(sesion.startAt).getTime();
+            if (sesion.id && inicio > ahora) {
+                if (proximaSesion === null || inicio < proximaSesion) {
+                    proximaSesion = inicio;
+                }
+                const clave = claveSesion(sesion);
+                if (trabajosPorSesion.get(sesion.id)?.clave === clave) {
+                    continue; // Ya tiene sus avisos armados en este proceso
+                }
+                if (sesionesProgramadas.has(clave)) {
+                    // Registrada en la DB pero sin trabajos en memoria: el proceso se reinició
+                    sesionesRearmadas++;
+                } else {
                     console.log(`Nueva sesión encontrada: ${sesion.name} de ${nombreEvento}. Programando avisos.`);
-                    programarAvisosParaSesion(sesion, nombreEvento);
-                    await markSessionAsScheduled(sesion.id);
-                    nuevasSesionesProgramadas++;
+                    nuevasClaves.push(clave);
                 }
+                programarAvisosParaSesion(sesion, nombreEvento, ahora, clave);
             }
         }
     }
 
-    if (nuevasSesionesProgramadas > 0) {
-        console.log(`Se programaron avisos para ${nuevasSesionesProgramadas} nuevas sesiones.`);
-    } else {
+    await markSessionsAsScheduled(nuevasClaves);
+
+    if (sesionesRearmadas > 0) {
+        console.log(`Se rearmaron los avisos de ${sesionesRearmadas} sesiones ya registradas (reinicio del proceso).`);
+    }
+    if (nuevasClaves.length > 0) {
+        console.log(`Se programaron avisos para ${nuevasClaves.length} nuevas sesiones.`);
+    } else if (sesionesRearmadas === 0) {
         console.log('No hay nuevas sesiones para programar en esta revisión.');
     }
+
+    return proximaSesion;
+}
+
+// Aunque no haya sesiones próximas, revisamos al menos una vez por semana
+const REVISION_MAXIMA_MS = 7 * MS_POR_DIA;
+
+let trabajoProximaRevision = null;
+
+/**
+ * Programa la próxima revisión de carreras.
+ * Si conocemos la próxima sesión, revisamos una hora después de que empiece (con un tope
+ * de una semana); si no, reintentamos en CHECK_INTERVAL_HOURS.
+ * @param {number|null} proximaSesion Timestamp (ms) de la próxima sesión conocida.
+ */
+function programarProximaRevision(proximaSesion) {
+    const ahora = Date.now();
+    const fechaRevision = new Date(proximaSesion === null
+        ? ahora + CONFIG.checkIntervalHours * MS_POR_HORA
+        : Math.min(proximaSesion + MS_POR_HORA, ahora + REVISION_MAXIMA_MS));
+
+    if (trabajoProximaRevision) {
+        trabajoProximaRevision.cancel();
+    }
+    trabajoProximaRevision = schedule.scheduleJob(fechaRevision, checkAndScheduleRaces);
+    console.log(`Próxima revisión de carreras programada para el ${fechaRevision.toLocaleString()}`);
+}
+
+// Revisión en curso, si la hay. Un /start durante la revisión periódica se suma a ella
+// en lugar de lanzar otra en paralelo que programaría las mismas sesiones dos veces.
+let revisionEnCurso = null;
+
+/**
+ * Lanza una revisión de carreras, o devuelve la que ya está en curso.
+ * Los errores se registran aquí para que nunca queden como promesas rechazadas sin manejar.
+ * @returns {Promise<void>}
+ */
+function checkAndScheduleRaces() {
+    if (!revisionEnCurso) {
+        revisionEnCurso = revisarYProgramarCarreras()
+            .catch(err => {
+                console.error('Error durante la revisión de carreras:', err.message);
+                return null;
+            })
+            .then(programarProximaRevision)
+            .finally(() => { revisionEnCurso = null; });
+    }
+    return revisionEnCurso;
 }
 
 // --- Comandos del Bot ---
@@ -192,16 +508,36 @@ bot.onText(/\/start/, (msg) => {
     checkAndScheduleRaces(); // Forzar revisión al recibir /start
 });
 
+// --- Apagado ---
+
+/**
+ * Libera los recursos abiertos (polling, trabajos programados, conexiones HTTP y de DB)
+ * para que el proceso termine limpio cuando Railway lo detiene.
+ * @param {string} signal La señal recibida.
+ */
+async function shutdown(signal) {
+    console.log(`Señal ${signal} recibida. Cerrando el bot...`);
+    try {
+        await bot.stopPolling();
+        await schedule.gracefulShutdown();
+        httpsAgent.destroy();
+        await pool.end();
+    } catch (err) {
+        console.error('Error durante el apagado:', err.message);
+    } finally {
+        process.exit(0);
+    }
+}
+
+process.once('SIGTERM', () => shutdown('SIGTERM'));
+process.once('SIGINT', () => shutdown('SIGINT'));
+
 // --- Función Principal ---
 
 async function main() {
     await setupDatabase();
 
-    // Programar la revisión periódica de carreras
-    schedule.scheduleJob(`0 */${CHECK_INTERVAL_HOURS} * * *`, checkAndScheduleRaces);
-    console.log(`Revisión periódica de carreras programada para ejecutarse cada ${CHECK_INTERVAL_HOURS} horas.`);
-
-    // Ejecutar una primera revisión al arrancar
+    // Ejecutar una primera revisión al arrancar; cada revisión programa la siguiente
     console.log('Realizando primera revisión de carreras al iniciar...');
     await checkAndScheduleRaces();
 }